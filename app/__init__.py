@@ -1,9 +1,12 @@
 """Provides the app package for the Social Insecurity application. The package contains the Flask app and all of the extensions and routes."""
 
+import sys
+import time
 from pathlib import Path
 from typing import cast
 
 from flask import Flask, flash, redirect, url_for, make_response
+from jinja2 import FileSystemBytecodeCache
 
 from app.config import Config
 from app.database import SQLite3
@@ -14,23 +17,39 @@ from flask_bcrypt import Bcrypt
 from flask_wtf.csrf import CSRFProtect
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
 
 
 # Instantiate and configure the app
 app = Flask(__name__)
+app.config.from_object(Config)
 bcrypt = Bcrypt(app)
 csfr = CSRFProtect(app)
-app.config.from_object(Config)
 login_manager = LoginManager()
 login_manager.init_app(app)
 limiter = Limiter(
     get_remote_address,
     app=app,
     default_limits=["500 per day", "100 per hour"],
-    storage_uri="memory://"
+    storage_uri=app.config["RATELIMIT_STORAGE_URI"],
+    strategy=app.config["RATELIMIT_STRATEGY"],
 )
 
 
+def init_password_hasher() -> None:
+    """Creates the argon2id password hasher from the app config."""
+    global password_hasher
+    password_hasher = PasswordHasher(
+        time_cost=app.config["ARGON2_TIME_COST"],
+        memory_cost=app.config["ARGON2_MEMORY_COST"],
+        parallelism=app.config["ARGON2_PARALLELISM"],
+    )
+
+
+init_password_hasher()
+
+
 class User(UserMixin):
     """
     Provides the User class for the application.
@@ -44,11 +63,36 @@ class User(UserMixin):
     @staticmethod
     def get(user_id):
         """Returns a User object based on the user id."""
-        user = sqlite.query_userid(user_id)
+        user = _get_user_row(user_id)
         if user is None:
             return None
         return User(user['id'], user['username'], user['first_name'], user['last_name'])
 
+
+_USER_CACHE_SIZE = 4096
+_user_rows = {}
+
+
+def _get_user_row(user_id):
+    """Returns the user row for the id, cached in-process between writes to the Users table.
+
+    Misses are not cached, so an id that does not exist yet is looked up again once it is registered.
+    """
+    user = _user_rows.get(user_id)
+    if user is None:
+        user = sqlite.query_userid(user_id)
+        if user is not None:
+            if len(_user_rows) >= _USER_CACHE_SIZE:
+                _user_rows.clear()
+            _user_rows[user_id] = user
+    return user
+
+
+def clear_user_cache() -> None:
+    """Invalidates the cached user rows. Must be called after inserting or updating users."""
+    _user_rows.clear()
+
+
 @login_manager.user_loader
 def load_user(user_id):
     return User.get(user_id)
@@ -60,21 +104,92 @@ def unauthorized():
     return redirect(url_for("index"))
 
 
+# Helper functions for tuning the argon2id time cost
+def _time_argon2_hash(time_cost: int) -> float:
+    """Returns the time in milliseconds it takes to hash with the given argon2id time cost."""
+    hasher = PasswordHasher(
+        time_cost=time_cost,
+        memory_cost=app.config["ARGON2_MEMORY_COST"],
+        parallelism=app.config["ARGON2_PARALLELISM"],
+    )
+    start = time.perf_counter()
+    hasher.hash("x")
+    return (time.perf_counter() - start) * 1000
+
+
+def calibrate_argon2_time_cost(budget_ms: float, min_cost: int = 1, max_cost: int = 10) -> int:
+    """Returns the largest argon2id time cost whose hashing time fits within the budget (in milliseconds)."""
+    time_cost = min_cost
+    for cost in range(min_cost, max_cost + 1):
+        if _time_argon2_hash(cost) > budget_ms:
+            break
+        time_cost = cost
+    return time_cost
+
+
+# Calibrate the time cost once at startup if a login time budget is configured
+if app.config.get("PASSWORD_HASH_BUDGET_MS"):
+    app.config["ARGON2_TIME_COST"] = calibrate_argon2_time_cost(app.config["PASSWORD_HASH_BUDGET_MS"])
+    init_password_hasher()
+
+
+# Helper functions for hashing and verifying passwords
+def _run_blocking(func, *args):
+    """Runs CPU-bound work, on gevent's native thread pool when monkey-patched so the hub keeps serving requests."""
+    monkey = sys.modules.get("gevent.monkey")
+    if monkey is not None and monkey.is_module_patched("threading"):
+        import gevent
+
+        return gevent.get_hub().threadpool.apply(func, args)
+    return func(*args)
+
+
+def hash_password(password: str) -> str:
+    """Returns an argon2id hash of the password."""
+    return _run_blocking(password_hasher.hash, password)
+
+
+def verify_password(password_hash: str, password: str) -> bool:
+    """Verifies the password against an argon2id hash, or a legacy bcrypt hash."""
+    if password_hash.startswith("$argon2"):
+        try:
+            return password_hasher.verify(password_hash, password)
+        except (VerificationError, InvalidHashError):
+            return False
+    return bcrypt.check_password_hash(password_hash, password)
+
+
+# Verified against when the user does not exist, so failed logins take the same time either way
+_DUMMY_PASSWORD_HASH = password_hasher.hash("dummy password")
+
+
 # Helper function for logging in
 def check_username_password(username: str, password: str) -> bool:
     """Login helper function"""
     user = sqlite.query_username(username)
     if not user:
+        _run_blocking(verify_password, _DUMMY_PASSWORD_HASH, password)
         return False
-    if username == user["username"] and bcrypt.check_password_hash(user["password"], password):
+    # Legacy bcrypt hashes are stored as bytes
+    password_hash = user["password"]
+    if isinstance(password_hash, bytes):
+        password_hash = password_hash.decode()
+    if username == user["username"] and _run_blocking(verify_password, password_hash, password):
+        # Upgrade legacy bcrypt hashes, and argon2 hashes with outdated parameters, on successful login
+        if not password_hash.startswith("$argon2") or password_hasher.check_needs_rehash(password_hash):
+            sqlite.update_password(user["id"], hash_password(password))
         return login_user(User(user["id"], user["username"], user["first_name"], user["last_name"]))
     return False
 
 
 # Helper function for uploading files
-def allowed_file(filename):
-    return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS'] 
+_ALLOWED_EXTENSIONS = frozenset(ext.lower() for ext in app.config["ALLOWED_EXTENSIONS"])
+
+
+def allowed_file(filename: str) -> bool:
+    """Returns whether the file has one of the allowed extensions."""
+    _, dot, ext = filename.rpartition('.')
+    return bool(dot) and ext.lower() in _ALLOWED_EXTENSIONS
 
 
 # Instantiate the sqlite database extension
@@ -83,21 +198,30 @@ sqlite = SQLite3(app, schema="schema.sql")
 # Create the instance and upload folder if they do not exist
 with app.app_context():
     instance_path = Path(app.instance_path)
-    if not instance_path.exists():
-        instance_path.mkdir(parents=True, exist_ok=True)
+    instance_path.mkdir(parents=True, exist_ok=True)
     upload_path = instance_path / cast(str, app.config["UPLOADS_FOLDER_PATH"])
-    if not upload_path.exists():
-        upload_path.mkdir(parents=True, exist_ok=True)
+    upload_path.mkdir(parents=True, exist_ok=True)
+    app.uploads_dir = upload_path
+
+# Reuse compiled templates across workers and restarts in production
+if app.config["JINJA_BYTECODE_CACHE"]:
+    app.config["TEMPLATES_AUTO_RELOAD"] = False
+    jinja_cache_path = Path(app.instance_path) / "jinja_cache"
+    jinja_cache_path.mkdir(parents=True, exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(directory=str(jinja_cache_path))
 
 # Add security headers
-@app.after_request
-def add_headers(resp):
-    resp.headers['Content-Security-Policy'] = (
+_CSP = (
     "default-src 'self';"
     "script-src 'self' cdn.jsdelivr.net 'unsafe-inline';"
     "style-src 'self' cdn.jsdelivr.net maxcdn.bootstrapcdn.com 'unsafe-inline';"
     "font-src maxcdn.bootstrapcdn.com;"
-    )
+)
+
+
+@app.after_request
+def add_headers(resp):
+    resp.headers['Content-Security-Policy'] = _CSP
     resp.headers['X-Frame-Options'] = 'SAMEORIGIN'
     resp.headers['X-Content-Type-Options'] = 'nosniff'
     # Remove the server header
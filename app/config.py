@@ -14,10 +14,58 @@ Example:
 """
 
 import os
+import tempfile
+from pathlib import Path
+
+
+def _load_or_create_secret_key(path: Path) -> bytes:
+    """Reads the secret key from the file, creating it with a new random key if it does not exist.
+
+    The key is written to a temporary file and linked into place, so concurrently starting workers
+    either create the key or read the complete key written by another worker.
+    """
+    try:
+        return path.read_bytes()
+    except FileNotFoundError:
+        pass
+    path.parent.mkdir(parents=True, exist_ok=True)
+    key = os.urandom(32)
+    # mkstemp picks an unused name and creates the file with mode 0600
+    fd, tmp_name = tempfile.mkstemp(prefix=f"{path.name}.", dir=path.parent)
+    tmp_path = Path(tmp_name)
+    try:
+        with os.fdopen(fd, "wb") as file:
+            file.write(key)
+        # Fails with FileExistsError if another worker created the key first
+        os.link(tmp_path, path)
+    except FileExistsError:
+        return path.read_bytes()
+    finally:
+        tmp_path.unlink()
+    return key
+
 
 class Config:
-    SECRET_KEY = os.urandom(32)  # Secret key for the application
+    # Secret key for the application, persisted in the instance folder so it is shared between workers and restarts
+    SECRET_KEY = os.environ.get("SECRET_KEY") or _load_or_create_secret_key(
+        Path(__file__).resolve().parent.parent / "instance" / ".secret_key"
+    )
     SQLITE3_DATABASE_PATH = "sqlite3.db"  # Path relative to the Flask instance folder
+    SQLITE3_POOL_SIZE = 8  # Idle database connections kept open per worker process
     UPLOADS_FOLDER_PATH = "uploads"  # Path relative to the Flask instance folder
     ALLOWED_EXTENSIONS = {'jpg', 'jpeg', 'png'} # Allowed file extensions for uploads
+    USE_X_SENDFILE = os.environ.get("USE_X_SENDFILE") == "1"  # Let Apache/lighttpd serve uploads via X-Sendfile
+    # Internal nginx location serving the uploads folder, e.g. "/protected-uploads/", used via X-Accel-Redirect
+    UPLOADS_ACCEL_REDIRECT = os.environ.get("UPLOADS_ACCEL_REDIRECT")
+    JINJA_BYTECODE_CACHE = os.environ.get("JINJA_BYTECODE_CACHE") == "1"  # Cache compiled templates in the instance folder
     SESSION_COOKIE_SAMESITE = 'Strict' # Prevents CSRF attacks
+    WTF_CSRF_TIME_LIMIT = None  # CSRF tokens are valid for the whole session instead of being regenerated hourly
+    # Rate limit storage shared between workers, e.g. "redis://localhost:6379/0" (requires the redis extra)
+    RATELIMIT_STORAGE_URI = os.environ.get("RATELIMIT_STORAGE_URI", "memory://")
+    RATELIMIT_STRATEGY = "moving-window"  # Atomic rolling window, implemented with Lua scripts on Redis
+    # Password hashing cost, production can raise it while CI and development lower it through the environment
+    ARGON2_TIME_COST = int(os.environ.get("ARGON2_TIME_COST", "2"))  # Number of argon2id iterations
+    ARGON2_MEMORY_COST = int(os.environ.get("ARGON2_MEMORY_COST", "19456"))  # Memory used per hash, in KiB
+    ARGON2_PARALLELISM = int(os.environ.get("ARGON2_PARALLELISM", "1"))  # Number of parallel lanes per hash
+    # If set, the time cost is calibrated at startup to fit this login budget, e.g. "250"
+    PASSWORD_HASH_BUDGET_MS = float(os.environ["PASSWORD_HASH_BUDGET_MS"]) if os.environ.get("PASSWORD_HASH_BUDGET_MS") else None
@@ -13,12 +13,23 @@ Example:
 from __future__ import annotations
 
 import sqlite3
+from collections import deque
 from os import PathLike
 from pathlib import Path
-from typing import Any, Optional, cast
+from typing import Iterable, Iterator, Optional
 
 from flask import Flask, current_app, g
 
+# Hot statements are kept as constants so they hit the connection's statement cache identically
+_QUERY_USERID = "SELECT id, username, first_name, last_name FROM Users WHERE id = ?"
+_QUERY_USERNAME = "SELECT id, username, password, first_name, last_name FROM Users WHERE username = ?"
+
+# Columns of the Users table that can be changed through the profile page
+_PROFILE_COLUMNS = frozenset({"education", "employment", "music", "movie", "nationality", "birthday"})
+
+# Idle connections kept per process, each can hold up to 64 MiB of page cache and a 256 MiB mmap
+_DEFAULT_POOL_SIZE = 8
+
 
 class SQLite3:
     """Provides a SQLite3 database extension for Flask.
@@ -54,6 +65,9 @@ class SQLite3:
             schema (optional): The path to the schema file. Is relative to the application root folder.
 
         """
+        # Idle connections are pooled between requests so SQLite's page and statement caches stay warm
+        self._pool: deque[sqlite3.Connection] = deque()
+        self._pool_size = _DEFAULT_POOL_SIZE
         if app is not None:
             self.init_app(app, path=path, schema=schema)
 
@@ -93,21 +107,47 @@ class SQLite3:
         if not self._path.exists():
             self._path.parent.mkdir(parents=True, exist_ok=True)
 
-        if schema:
-            with app.app_context():
-                self._init_database(schema)
+        self._pool_size = app.config.get("SQLITE3_POOL_SIZE", _DEFAULT_POOL_SIZE)
+
         app.teardown_appcontext(self._close_connection)
+        with app.app_context():
+            # WAL is persisted in the database file, so it only has to be enabled once
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            if schema:
+                self._init_database(schema)
+        # Do not hand connections opened during start-up to forked worker processes
+        while self._pool:
+            self._pool.pop().close()
 
     @property
     def connection(self) -> sqlite3.Connection:
-        """Returns the connection to the SQLite3 database."""
+        """Returns the request's connection to the SQLite3 database, taken from the pool on first use."""
         conn = getattr(g, "flask_sqlite3_connection", None)
         if conn is None:
-            conn = g.flask_sqlite3_connection = sqlite3.connect(self._path)
-            conn.row_factory = sqlite3.Row
+            conn = g.flask_sqlite3_connection = self._acquire_connection()
         return conn
 
-    def query_friends(self, user_id: str) -> list[sqlite3.Row] | None:
+    def _acquire_connection(self) -> sqlite3.Connection:
+        """Returns an idle pooled connection, or opens a new one if the pool is empty."""
+        try:
+            return self._pool.pop()
+        except IndexError:
+            pass
+        conn = sqlite3.connect(self._path, check_same_thread=False, cached_statements=256, isolation_level="DEFERRED")
+        conn.row_factory = sqlite3.Row
+        self._configure_connection(conn)
+        return conn
+
+    @staticmethod
+    def _configure_connection(conn: sqlite3.Connection) -> None:
+        """Applies the per-connection performance pragmas to a new connection."""
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA mmap_size=268435456")
+        conn.execute("PRAGMA cache_size=-65536")
+
+    def query_friends(self, user_id: str) -> Iterator[sqlite3.Row]:
+        """Fetch the user's friends from the database. The rows are streamed lazily from the cursor."""
         cursor = self.connection.execute(
             """
             SELECT U.id, U.username
@@ -116,14 +156,11 @@ class SQLite3:
             WHERE F.u_id = ?
             """, (user_id,)
         )
-        friends = cursor.fetchall()
-        return friends
+        return cursor
 
     def query_userid(self, userid) -> dict | None:
         """Fetch userid from the database."""
-        cursor = self.connection.execute(
-            "SELECT id, username, first_name, last_name FROM Users WHERE id = ?", (userid,)
-            )
+        cursor = self.connection.execute(_QUERY_USERID, (userid,))
         user = cursor.fetchone()
         return user
     
@@ -137,50 +174,62 @@ class SQLite3:
     
     def query_username(self, username) -> sqlite3.Row | None:
         """Fetch user from the database."""
-        cursor = self.connection.execute(
-            "SELECT id, username, password, first_name, last_name FROM Users WHERE username = ?", (username,)
-            )
+        cursor = self.connection.execute(_QUERY_USERNAME, (username,))
         user = cursor.fetchone()
         return user
 
-    def query_posts(self, userid: str) -> list[sqlite3.Row] | None:
-        """Fetch posts from the database."""
+    def query_posts(self, userid: str) -> Iterator[sqlite3.Row]:
+        """Fetch posts from the database. The rows are streamed lazily from the cursor."""
         cursor = self.connection.execute(
-         """
-         SELECT p.*, u.id, u.username,
-         (SELECT COUNT(*) FROM Comments WHERE p_id = p.id) AS cc
-         FROM Posts AS p JOIN Users AS u ON u.id = p.u_id
-         WHERE p.u_id IN (SELECT u_id FROM Friends WHERE f_id = ?) OR p.u_id IN (SELECT f_id FROM Friends WHERE u_id = ?) OR p.u_id = ? 
-         ORDER BY p.creation_time DESC;
+        """
+        WITH visible(u) AS (
+            SELECT f_id FROM Friends WHERE u_id = ?
+            UNION SELECT u_id FROM Friends WHERE f_id = ?
+            UNION SELECT ?
+        )
+        SELECT p.*, u.username, COUNT(c.id) AS cc
+        FROM Posts AS p JOIN Users AS u ON u.id = p.u_id
+        LEFT JOIN Comments AS c ON c.p_id = p.id
+        WHERE p.u_id IN visible
+        GROUP BY p.id
+        ORDER BY p.creation_time DESC;
         """, (userid, userid, userid)
         )
-        posts = cursor.fetchall()
-        return posts
+        return cursor
     
-    def query_post(self, post_id: str) -> sqlite3.Row | None:
-        """Fetch post from the database."""
+    def query_post_with_comments(self, post_id: str) -> tuple[dict | None, list[dict]]:
+        """Fetch a post and its comments from the database in a single query."""
         cursor = self.connection.execute(
         """
-        SELECT *
+        SELECT p.id, p.content, p.image, p.creation_time, u.id AS author_id, u.username, u.first_name, u.last_name,
+               c.id AS c_id, c.u_id AS c_uid, c.comment, c.creation_time AS c_time, cu.username AS c_username
         FROM Posts AS p JOIN Users AS u ON p.u_id = u.id
-        WHERE p.id = ?;
-        """, (post_id,)
-            )
-        post = cursor.fetchone()
-        return post
-    
-    def query_comments(self, post_id: str) -> list[sqlite3.Row] | None:
-        """Fetch comments from the database."""
-        cursor = self.connection.execute(
-        """
-        SELECT DISTINCT *
-        FROM Comments AS c JOIN Users AS u ON c.u_id = u.id
-        WHERE c.p_id = ?
+        LEFT JOIN Comments AS c ON c.p_id = p.id
+        LEFT JOIN Users AS cu ON c.u_id = cu.id
+        WHERE p.id = ?
         ORDER BY c.creation_time DESC;
         """, (post_id,)
         )
-        comments = cursor.fetchall()
-        return comments
+        rows = cursor.fetchall()
+        if not rows:
+            return None, []
+        first = rows[0]
+        post = {
+            key: first[key]
+            for key in ("id", "content", "image", "creation_time", "author_id", "username", "first_name", "last_name")
+        }
+        comments = [
+            {
+                "id": row["c_id"],
+                "u_id": row["c_uid"],
+                "comment": row["comment"],
+                "creation_time": row["c_time"],
+                "username": row["c_username"],
+            }
+            for row in rows
+            if row["c_id"] is not None
+        ]
+        return post, comments
 
     def check_user_exists(self, username) -> bool:
         cursor = self.connection.execute(
@@ -191,15 +240,6 @@ class SQLite3:
             return True
         return False
     
-    def check_post_exists(self, post_id) -> bool:
-        cursor = self.connection.execute(
-            "SELECT id FROM Posts WHERE id = ?", (post_id,)
-            )
-        post = cursor.fetchone()
-        if post:
-            return True
-        return False
-    
     def check_comment_exists(self, comment_id) -> bool:
         cursor = self.connection.execute(
             "SELECT id FROM Comments WHERE id = ?", (comment_id,)
@@ -224,21 +264,26 @@ class SQLite3:
             return True
         return False
     
+    def is_friend(self, user_id, friend_id) -> bool:
+        """Check whether the friend is in the user's friendlist."""
+        cursor = self.connection.execute(
+            "SELECT EXISTS(SELECT 1 FROM Friends WHERE u_id = :u AND f_id = :f)", {"u": user_id, "f": friend_id}
+            )
+        return bool(cursor.fetchone()[0])
+
     def insert_user(self, user:dict) -> None:
         """Insert user into the database."""
         cursor = self.connection.execute(
             "INSERT INTO Users (username, password, first_name, last_name) VALUES (?, ?, ?, ?)",
              (user.get('username'), user.get('password'), user.get('first_name'), user.get('last_name'))
             )
-        self.connection.commit()
 
-    def insert_post(self, user_id, content, image ) -> None:
+    def insert_post(self, user_id, content, image) -> None:
         """Insert post into the database."""
         self.connection.execute(
             "INSERT INTO Posts (u_id, content, image, creation_time) VALUES (?, ?, ?, CURRENT_TIMESTAMP)",
             (user_id, content, image)
             )
-        self.connection.commit()
 
     def insert_friend(self, user_id, friend_id) -> None:
         cursor = self.connection.execute(
@@ -249,7 +294,6 @@ class SQLite3:
         )
         # Check how many rows were inserted
         print(cursor.rowcount)
-        self.connection.commit()
 
     def insert_comment(self, post_id, comment, user_id) -> None:
         """Insert comment into the database."""
@@ -260,30 +304,41 @@ class SQLite3:
             VALUES (?, ?, ?, CURRENT_TIMESTAMP);
             """, (post_id, user_id, comment)
         )
-        self.connection.commit()
+
+    def insert_posts(self, rows: Iterable[tuple]) -> None:
+        """Insert several (user_id, content, image) posts into the database in one batch."""
+        self.connection.executemany(
+            "INSERT INTO Posts (u_id, content, image, creation_time) VALUES (?, ?, ?, CURRENT_TIMESTAMP)",
+            rows
+            )
+
+    def insert_friends(self, rows: Iterable[tuple]) -> None:
+        """Insert several (user_id, friend_id) friend connections into the database in one batch."""
+        self.connection.executemany(
+            "INSERT INTO Friends (u_id, f_id) VALUES (?, ?)",
+            rows
+            )
+
+    def insert_comments(self, rows: Iterable[tuple]) -> None:
+        """Insert several (post_id, comment, user_id) comments into the database in one batch, matching insert_comment."""
+        self.connection.executemany(
+            "INSERT INTO Comments (p_id, comment, u_id, creation_time) VALUES (?, ?, ?, CURRENT_TIMESTAMP)",
+            rows
+            )
+
+    def update_password(self, user_id, password_hash: str) -> None:
+        """Update the user's password hash in the database."""
+        self.connection.execute(
+            "UPDATE Users SET password = ? WHERE id = ?", (password_hash, user_id)
+            )
 
     def update_profile(self, user_id, data: dict) -> None:
-        query = """
-            UPDATE Users
-            SET
-            education = COALESCE(?, education),
-            employment = COALESCE(?, employment),
-            music = COALESCE(?, music),
-            movie = COALESCE(?, movie),
-            nationality = COALESCE(?, nationality),
-            birthday = COALESCE(?, birthday)
-            WHERE id = ?;
-        """
-        self.connection.execute(query, (
-            data.get("education"),
-            data.get("employment"),
-            data.get("music"),
-            data.get("movie"),
-            data.get("nationality"),
-            data.get("birthday"),
-            user_id
-        ))
-        self.connection.commit()
+        """Update the user's profile, only writing the fields that were provided."""
+        columns = {key: value for key, value in data.items() if value is not None and key in _PROFILE_COLUMNS}
+        if not columns:
+            return
+        query = "UPDATE Users SET " + ", ".join(f"{key} = ?" for key in columns) + " WHERE id = ?;"
+        self.connection.execute(query, (*columns.values(), user_id))
 
     def _init_database(self, schema: PathLike | str) -> None:
         """Initializes the database with the supplied schema if it does not exist yet."""
@@ -292,7 +347,17 @@ class SQLite3:
             self.connection.commit()
 
     def _close_connection(self, exception: Optional[BaseException] = None) -> None:
-        """Closes the connection to the database."""
-        conn = cast(sqlite3.Connection, getattr(g, "flask_sqlite3_connection", None))
+        """Commits the request's transaction, or rolls it back on error, and returns the connection to the pool.
+
+        The connection is closed instead if the pool already holds the maximum number of idle connections.
+        """
+        conn: Optional[sqlite3.Connection] = g.pop("flask_sqlite3_connection", None)
         if conn is not None:
-            conn.close()
\ No newline at end of file
+            if exception is None:
+                conn.commit()
+            else:
+                conn.rollback()
+            if len(self._pool) < self._pool_size:
+                self._pool.append(conn)
+            else:
+                conn.close()
\ No newline at end of file
@@ -4,12 +4,18 @@ This file contains the routes for the application. It is imported by the app pac
 It also contains the SQL queries used for communicating with the database.
 """
 
-from pathlib import Path
-from flask import flash, redirect, make_response, render_template, send_from_directory, url_for, session
+import mimetypes
+import re
+import secrets
+from urllib.parse import quote
+
+from flask import flash, redirect, make_response, render_template, request, send_from_directory, url_for
 from flask_login import login_required, logout_user, current_user
-from app import app, sqlite, bcrypt, check_username_password, allowed_file
+from app import app, sqlite, hash_password, check_username_password, allowed_file, clear_user_cache
 from app.forms import CommentsForm, FriendsForm, IndexForm, PostForm, ProfileForm
-from werkzeug.utils import secure_filename
+
+# Characters not allowed in stored upload filenames
+_UNSAFE_FILENAME_CHARS = re.compile(r"[^A-Za-z0-9._-]+")
 
 
 @app.route("/", methods=["GET", "POST"])
@@ -21,11 +27,13 @@ def index():
     it either logs the user in or registers a new user.
 
     If no form was submitted, it simply renders the index page.
+    Plain GET requests render a static variant of the page without constructing the forms.
     """
     # Check if the user is already logged in
     if current_user.is_authenticated:
-        username = sqlite.query_userid(current_user.get_id())["username"]
-        return redirect(url_for("stream", username=username))
+        return redirect(url_for("stream", username=current_user.username))
+    if request.method == "GET":
+        return make_response(render_template("index_empty.html", title="Welcome"))
     index_form = IndexForm()
     login_form = index_form.login
     register_form = index_form.register
@@ -42,7 +50,7 @@ def index():
         # Check if user exists
         user = {
             'username': register_form.username.data,
-            'password': bcrypt.generate_password_hash(register_form.password.data),
+            'password': hash_password(register_form.password.data),
             'first_name': register_form.first_name.data,
             'last_name': register_form.last_name.data,
         }
@@ -50,6 +58,7 @@ def index():
             flash("User already exists!", category="warning")
             return make_response(render_template("index.html", title="Welcome", form=index_form), 400)
         sqlite.insert_user(user)
+        clear_user_cache()
         flash("User successfully created!", category="success")
         return make_response(render_template("index.html", title="Welcome", form=index_form), 201)
     elif login_form.submit.data or register_form.submit.data:
@@ -62,32 +71,34 @@ def index():
 def stream(username: str):
     """Provides the stream page for the application.
 
-    If a form was submitted, it reads the form data and inserts a new post into the database.
+    If a form was submitted, it reads the form data, inserts a new post into the database and redirects back to the stream.
 
     Otherwise, it reads the username from the URL and displays all posts from the user and their friends.
     """
-    if not sqlite.check_user_exists(username):
+    stream_user = sqlite.query_username(username)
+    if stream_user is None:
         flash("User does not exist!", category="warning")
         # Redirect user to the index page
         return redirect(url_for("index"))
     post_form = PostForm()
-    stream_user_id = sqlite.query_username(username)["id"]
-    posts = sqlite.query_posts(stream_user_id)
+    stream_user_id = stream_user["id"]
     if post_form.validate_on_submit():
         filename = ""
         if post_form.image.data:
             if allowed_file(post_form.image.data.filename):
-                filename = secure_filename(post_form.image.data.filename)
-                path = Path(app.instance_path) / app.config["UPLOADS_FOLDER_PATH"] / filename 
-                post_form.image.data.save(path)
+                # Prefix with a random token so uploads with the same name do not overwrite each other
+                safe_name = _UNSAFE_FILENAME_CHARS.sub("_", post_form.image.data.filename)
+                filename = f"{secrets.token_hex(8)}_{safe_name}"
+                post_form.image.data.save(app.uploads_dir / filename)
             else:
                 flash("Invalid file type!", category="warning")
+                posts = sqlite.query_posts(stream_user_id)
                 return make_response(render_template("stream.html", title="Stream", username=username, form=post_form, posts=posts), 400)
         sqlite.insert_post(current_user.get_id(), post_form.content.data, filename)
         flash("Post successfully created!", category="success")
-        # Update the posts
-        posts = sqlite.query_posts(stream_user_id)
-        return make_response(render_template("stream.html", title="Stream", username=username, form=post_form, posts=posts), 201)
+        # Post/Redirect/GET, so the feed is only queried once by the following GET
+        return redirect(url_for("stream", username=username), code=303)
+    posts = sqlite.query_posts(stream_user_id)
     return make_response(render_template("stream.html", title="Stream", username=username, form=post_form, posts=posts))
 
 @app.route("/comments/<string:username>/<int:post_id>", methods=["GET", "POST"])
@@ -97,15 +108,14 @@ def comments(username: str, post_id: int):
     If a form was submitted, it reads the form data and inserts a new comment into the database.
     Otherwise, it reads the username and post id from the URL and displays all comments for the post.
     """
-    if not sqlite.check_user_exists(username) or not sqlite.check_post_exists(post_id):
+    post, comments = sqlite.query_post_with_comments(post_id)
+    if post is None or not sqlite.check_user_exists(username):
         flash("User or post does not exist!", category="warning")
         return redirect(url_for("index"))
-    post = sqlite.query_post(post_id)
-    comments = sqlite.query_comments(post_id)
     comments_form = CommentsForm()
     if comments_form.validate_on_submit():
         sqlite.insert_comment(post_id, comments_form.comment.data, current_user.get_id())
-        comments = sqlite.query_comments(post_id)
+        post, comments = sqlite.query_post_with_comments(post_id)
         return make_response(render_template("comments.html", title="Comments", username=username, form=comments_form, post=post, comments=comments), 201)
     return make_response(render_template("comments.html", title="Comments", username=username, form=comments_form, post=post, comments=comments))
 
@@ -124,11 +134,12 @@ def friends(username: str):
     If a form was submitted, it reads the form data and inserts a new friend into the database.
     Otherwise, it reads the username from the URL and displays all friends of the user.
     """
-    if not sqlite.check_user_exists(username):
+    friends_user = sqlite.query_username(username)
+    if friends_user is None:
         flash("User does not exist!", category="warning")
         return redirect(url_for("index"))
     friends_form = FriendsForm()
-    friends_user_id = str(sqlite.query_username(username)["id"])
+    friends_user_id = str(friends_user["id"])
     friends = sqlite.query_friends(friends_user_id)
     if friends_form.validate_on_submit():
         # Check if the current user is the owner of the friendslist being edited
@@ -143,13 +154,10 @@ def friends(username: str):
         elif str(friend["id"]) == current_user.get_id():
             flash("You cannot be friends with yourself!", category="warning")
             return make_response(render_template("friends.html", title="Friends", username=username, friends=friends, form=friends_form), 400)
-        # Fetch the friends in the friendlist
-        friends = sqlite.query_friends(friends_user_id)
         # Check if the friend is already in the friendlist
-        for f in friends:
-            if friend["id"] == f["id"]:
-                flash("You are already friends with this user!", category="warning")
-                return make_response(render_template("friends.html", title="Friends", username=username, friends=friends, form=friends_form), 400)
+        if sqlite.is_friend(friends_user_id, friend["id"]):
+            flash("You are already friends with this user!", category="warning")
+            return make_response(render_template("friends.html", title="Friends", username=username, friends=friends, form=friends_form), 400)
         # All checks passed, add the friend to the friendlist
         sqlite.insert_friend(current_user.get_id(), friend["id"])
         flash("Friend successfully added!", category="success") 
@@ -166,27 +174,26 @@ def profile(username: str):
     If a form was submitted, it reads the form data and updates the user's profile in the database.
     Otherwise, it reads the username from the URL and displays the user's profile.
     """
-    if not sqlite.check_user_exists(username):
+    user = sqlite.query_userprofile(username)
+    if user is None:
         flash("User does not exist!", category="warning")
         return redirect(url_for("index"))
     profile_form = ProfileForm()
-    user = sqlite.query_userprofile(username)
     if profile_form.validate_on_submit():
         # Check if the current user is the same as the user whose profile is being updated
         if current_user.get_id() != str(user["id"]):
             flash("You cannot update another user's profile!", category="warning")
             return make_response(render_template("profile.html", title="Profile", username=username, user=user, form=profile_form), 401)
         data = {
-            "education": profile_form.education.data if profile_form.education.data else None,
-            "employment": profile_form.employment.data if profile_form.employment.data else None,
-            "music": profile_form.music.data if profile_form.music.data else None,
-            "movie": profile_form.movie.data if profile_form.movie.data else None,
-            "nationality": profile_form.nationality.data if profile_form.nationality.data else None,
-            "birthday": profile_form.birthday.data if profile_form.birthday.data else None,
+            key: getattr(profile_form, key).data or None
+            for key in ("education", "employment", "music", "movie", "nationality", "birthday")
         }
-        sqlite.update_profile(current_user.get_id(), data) 
-        # Update the profile
-        user = sqlite.query_userprofile(username)
+        # Skip the write entirely if no field was filled in
+        if any(data.values()):
+            sqlite.update_profile(current_user.get_id(), data)
+            clear_user_cache()
+        # Update the displayed profile with the submitted data instead of querying it again
+        user = {**dict(user), **{key: value for key, value in data.items() if value is not None}}
         return make_response(render_template("profile.html", title="Profile", username=username, user=user, form=profile_form), 201)
     return make_response(render_template("profile.html", title="Profile", username=username, user=user, form=profile_form))
 
@@ -195,7 +202,13 @@ def profile(username: str):
 def uploads(filename):
     """Provides an endpoint for serving uploaded files."""
     # Check if file exists
-    if not Path(app.instance_path) / app.config["UPLOADS_FOLDER_PATH"] / filename:
+    if not (app.uploads_dir / filename).is_file():
         flash("File does not exist!", category="warning")
-        return make_response(render_template("index.html", title="Welcome", form=IndexForm()), 404)
-    return send_from_directory(Path(app.instance_path) / app.config["UPLOADS_FOLDER_PATH"], filename)
\ No newline at end of file
+        return make_response(render_template("index_empty.html", title="Welcome"), 404)
+    # Let nginx stream the file once the user has been authenticated
+    if app.config["UPLOADS_ACCEL_REDIRECT"]:
+        response = make_response("")
+        response.headers["X-Accel-Redirect"] = app.config["UPLOADS_ACCEL_REDIRECT"] + quote(filename)
+        response.mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        return response
+    return send_from_directory(app.uploads_dir, filename)
\ No newline at end of file
@@ -7,9 +7,7 @@
 -- Table 'Users'
 --
 -- ---
-DROP TABLE IF EXISTS [Users];
-
-CREATE TABLE [Users] (
+CREATE TABLE IF NOT EXISTS [Users] (
   id INTEGER PRIMARY KEY,
   username VARCHAR UNIQUE,
   first_name VARCHAR,
@@ -27,9 +25,7 @@ CREATE TABLE [Users] (
 -- Table 'Posts'
 --
 -- ---
-DROP TABLE IF EXISTS [Posts];
-
-CREATE TABLE [Posts](
+CREATE TABLE IF NOT EXISTS [Posts](
   id INTEGER PRIMARY KEY,
   u_id INTEGER,
   content INTEGER,
@@ -42,9 +38,7 @@ CREATE TABLE [Posts](
 -- Table 'Friends'
 --
 -- ---
-DROP TABLE IF EXISTS [Friends];
-
-CREATE TABLE [Friends](
+CREATE TABLE IF NOT EXISTS [Friends](
   u_id INTEGER NOT NULL REFERENCES Users,
   f_id INTEGER NOT NULL REFERENCES Users,
   PRIMARY KEY(u_id, f_id),
@@ -56,9 +50,7 @@ CREATE TABLE [Friends](
 -- Table 'Comments'
 --
 -- ---
-DROP TABLE IF EXISTS [Comments];
-
-CREATE TABLE [Comments](
+CREATE TABLE IF NOT EXISTS [Comments](
   id INTEGER PRIMARY KEY,
   p_id INTEGER,
   u_id INTEGER,
@@ -66,4 +58,11 @@ CREATE TABLE [Comments](
   [creation_time] DATETIME,
   FOREIGN KEY (p_id) REFERENCES Posts(id),
   FOREIGN KEY (u_id) REFERENCES Users(id)
-);
\ No newline at end of file
+);
+-- ---
+-- Indexes
+-- Users(username) and Friends(u_id, f_id) are already covered by their UNIQUE and PRIMARY KEY constraints
+-- ---
+CREATE INDEX IF NOT EXISTS idx_friends_fid ON Friends(f_id, u_id);
+CREATE INDEX IF NOT EXISTS idx_comments_pid_time ON Comments(p_id, creation_time DESC);
+CREATE INDEX IF NOT EXISTS idx_posts_uid_time ON Posts(u_id, creation_time DESC);
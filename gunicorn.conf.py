@@ -0,0 +1,10 @@
+"""Provides the gunicorn configuration for running the Social Insecurity application in production."""
+
+import multiprocessing
+
+wsgi_app = "wsgi:app"
+worker_class = "gevent"
+workers = multiprocessing.cpu_count() * 2 + 1
+worker_connections = 1000
+# Share compiled templates between workers and restarts
+raw_env = ["JINJA_BYTECODE_CACHE=1"]
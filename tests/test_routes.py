@@ -1,11 +1,14 @@
 from __future__ import annotations
 
+import re
+import sqlite3
 from collections.abc import Iterator
+from contextlib import closing
 from typing import TYPE_CHECKING
 
 import pytest
 
-from app import app
+from app import app, init_password_hasher, sqlite
 
 if TYPE_CHECKING:
     from flask import Flask
@@ -13,15 +16,29 @@ if TYPE_CHECKING:
 
 
 @pytest.fixture(scope="session")
-def test_app() -> Iterator[Flask]:
+def test_app(tmp_path_factory: pytest.TempPathFactory) -> Iterator[Flask]:
     app.config.update(
         {
-            "SQLITE3_DATABASE": "file::memory:?cache=shared",
             "TESTING": True,
             "WTF_CSRF_ENABLED": False,
+            # Cheap password hashing keeps the registration and login tests fast
+            "ARGON2_TIME_COST": 1,
+            "ARGON2_MEMORY_COST": 8,
         }
     )
+    init_password_hasher()
+    # The extension is set up on import, so point it at a throwaway database to keep test users out of the instance folder
+    _close_pooled_connections()
+    sqlite._path = tmp_path_factory.mktemp("database") / "sqlite3.db"
+    with app.app_context():
+        sqlite._init_database("schema.sql")
     yield app
+    _close_pooled_connections()
+
+
+def _close_pooled_connections() -> None:
+    while sqlite._pool:
+        sqlite._pool.pop().close()
 
 
 @pytest.fixture()
@@ -32,3 +49,110 @@ def client(test_app: Flask) -> FlaskClient:
 def test_request_index(client: FlaskClient):
     response = client.get("/")
     assert response.status_code == 200
+
+
+@pytest.mark.parametrize(
+    "filename, expected",
+    [("image.png", True), ("photo.JPG", True), ("archive.tar.jpeg", True), ("script.py", False), ("png", False)],
+)
+def test_allowed_file(filename: str, expected: bool):
+    from app import allowed_file
+
+    assert allowed_file(filename) is expected
+
+
+def register(client: FlaskClient, username: str) -> None:
+    client.post(
+        "/",
+        data={
+            "register-first_name": "Test",
+            "register-last_name": "User",
+            "register-username": username,
+            "register-password": "password1",
+            "register-confirm_password": "password1",
+            "register-submit": "Sign Up",
+        },
+    )
+
+
+def login(client: FlaskClient, username: str) -> None:
+    client.post("/", data={"login-username": username, "login-password": "password1", "login-submit": "Sign In"})
+
+
+def test_add_friend_twice_is_rejected(client: FlaskClient):
+    owner, target = "owner", "target"
+    for username in (owner, target):
+        register(client, username)
+    login(client, owner)
+
+    data = {"username": target, "submit": "Add Friend"}
+    assert client.post(f"/friends/{owner}", data=data).status_code == 201
+    assert client.post(f"/friends/{owner}", data=data).status_code == 400
+
+
+@pytest.mark.parametrize("budget_ms, expected", [(0, 1), (100, 2), (250, 6), (10_000, 10)])
+def test_calibrate_argon2_time_cost_fits_budget(monkeypatch: pytest.MonkeyPatch, budget_ms: float, expected: int):
+    import app as app_module
+
+    # Simulate hashing that takes 40 ms per iteration
+    monkeypatch.setattr(app_module, "_time_argon2_hash", lambda time_cost: time_cost * 40.0)
+    assert app_module.calibrate_argon2_time_cost(budget_ms, min_cost=1, max_cost=10) == expected
+
+
+def test_connection_pool_is_bounded(monkeypatch: pytest.MonkeyPatch, test_app: Flask):
+    monkeypatch.setattr(sqlite, "_pool_size", 1)
+    with test_app.app_context():
+        first = sqlite.connection
+        with test_app.app_context():
+            second = sqlite.connection
+    assert first is not second
+    assert len(sqlite._pool) == 1
+
+
+def test_uploads_only_serves_files(monkeypatch: pytest.MonkeyPatch, client: FlaskClient):
+    username = "uploader"
+    register(client, username)
+    login(client, username)
+
+    monkeypatch.setitem(client.application.config, "UPLOADS_ACCEL_REDIRECT", "/protected-uploads/")
+    response = client.get("/uploads/%2e%2e")
+    assert response.status_code == 404
+    assert "X-Accel-Redirect" not in response.headers
+
+
+def test_new_post_redirects_to_stream(client: FlaskClient):
+    username = "poster"
+    register(client, username)
+    login(client, username)
+
+    response = client.post(f"/stream/{username}", data={"content": "Hello", "submit": "Post"})
+    assert response.status_code == 303
+    assert response.headers["Location"] == f"/stream/{username}"
+    assert b"Hello" in client.get(f"/stream/{username}").data
+
+
+def test_batch_insert_is_committed_on_teardown(test_app: Flask):
+    with test_app.app_context():
+        sqlite.insert_comments([(9001, "first", 1), (9001, "second", 2)])
+
+    # A separate connection only sees the rows once the request's transaction was committed
+    with closing(sqlite3.connect(sqlite._path)) as conn:
+        rows = conn.execute("SELECT comment, u_id FROM Comments WHERE p_id = 9001 ORDER BY id").fetchall()
+    assert rows == [("first", 1), ("second", 2)]
+
+
+def test_index_empty_matches_rendered_index_form(monkeypatch: pytest.MonkeyPatch, test_app: Flask):
+    from flask import render_template
+
+    from app.forms import IndexForm
+
+    monkeypatch.setitem(test_app.config, "WTF_CSRF_ENABLED", True)
+    with test_app.test_request_context("/"):
+        rendered = render_template("index.html", title="Welcome", form=IndexForm())
+        static = render_template("index_empty.html", title="Welcome")
+
+    def normalize(html: str) -> str:
+        html = re.sub(r'(name="csrf_token" type="hidden" value=")[^"]*', r"\1", html)
+        return " ".join(html.split())
+
+    assert normalize(static) == normalize(rendered)
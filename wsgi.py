@@ -0,0 +1,16 @@
+#!/usr/bin/env python
+
+"""Configured as the production entry point for the Social Insecurity application.
+
+Gevent monkey-patches the standard library before the app is imported, so handlers yield while waiting on I/O.
+Each request borrows a SQLite connection from the extension's pool and returns it on teardown, so connections
+are reused across greenlets instead of being opened per request.
+
+To start the application enter 'pdm run gunicorn' in a terminal, the settings are read from gunicorn.conf.py.
+"""
+
+from gevent import monkey
+
+monkey.patch_all()
+
+from app import app  # noqa: E402,F401